@@ -1,15 +1,23 @@
 import os
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import json
 import uvicorn
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, get_args
 
 # Import our agent
-from my_agent.agent import graph  # Use the compiled graph instead of workflow
+from my_agent.agent import graph, GraphMode  # Use the compiled graph instead of workflow
 from my_agent.utils.state import AgentState
+from my_agent.utils.admission import admission, AdmissionRejected
+from my_agent.utils.workers import worker_pool, encode_json
+from my_agent.utils.cancellation import (
+    CancellationToken, CancellationCallback, RunCancelled, cancellation_scope, cancellation_stats
+)
 
 # Load environment variables first thing
 load_dotenv()
@@ -20,7 +28,6 @@ API_KEYS = [
     "OPENAI_API_KEY",
     "SERPER_API_KEY",
     "METAPHOR_API_KEY", 
-    "BROWSERLESS_API_KEY",
     "LANGCHAIN_API_KEY",
     "LANGSMITH_API_KEY"
 ]
@@ -36,8 +43,22 @@ for key in API_KEYS:
         print(f"⚠️ Warning: {key} not found in environment variables!")
 print("===========================\n")
 
+# Responses whose messages hold more characters than this are encoded in the worker pool
+LARGE_RESPONSE_CHARS = int(os.environ.get("LARGE_RESPONSE_CHARS", 256 * 1024))
+# How often a running /chat request checks whether the client is still connected
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 1))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    worker_pool.start()
+    # Sync graph nodes and tools run on the loop's default executor, use the sized I/O pool
+    asyncio.get_running_loop().set_default_executor(worker_pool.io_executor)
+    yield
+    worker_pool.shutdown()
+
 # Create the FastAPI app with explicit configuration
 app = FastAPI(
+    lifespan=lifespan,
     title="AI Research Assistant",
     description="API for AI Research Assistant",
     version="1.0.0",
@@ -57,6 +78,15 @@ app.add_middleware(
 
 # Global storage for conversations (in-memory, will reset on server restart)
 conversations = {}
+# Numbers for new conversation IDs. A new conversation is only added to `conversations`
+# once its first request has been admitted, so IDs can't be derived from its size.
+conversation_numbers = itertools.count(1)
+
+def new_conversation_id() -> str:
+    while True:
+        conversation_id = f"conv_{next(conversation_numbers)}"
+        if conversation_id not in conversations:
+            return conversation_id
 
 @app.get("/")
 async def root():
@@ -84,8 +114,132 @@ async def debug_info():
         }
     }
 
+async def chat_response(content: Dict[str, Any]):
+    """Return content as is, or pre-encoded off the event loop when the history is large."""
+    size = sum(len(str(getattr(m, "content", m))) for m in content["messages"])
+    if size < LARGE_RESPONSE_CHARS:
+        return content
+    body = await worker_pool.run_cpu(encode_json, content)
+    return Response(content=body, media_type="application/json")
+
+async def watch_disconnect(http_request: Request, graph_task: asyncio.Task, token: CancellationToken):
+    """Cancel the graph run as soon as the client goes away."""
+    while not graph_task.done():
+        if await http_request.is_disconnected():
+            print("Client disconnected, cancelling graph run")
+            token.cancel()
+            graph_task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+def partial_history(messages: List[Any]) -> List[Any]:
+    """Messages of an interrupted run that are safe to keep in the conversation."""
+    messages = list(messages)
+    # A model turn whose tool calls never got results would be rejected by the API next turn
+    if messages and getattr(messages[-1], "tool_calls", None):
+        messages.pop()
+    return messages
+
+async def run_chat(http_request: Request, conversation_id: str, message: str, model_name: str, mode: str):
+    """Run the graph for one chat turn. Called with the conversation lock and a run slot held."""
+    token = CancellationToken()
+    # The client may have given up while the request was queued
+    if await http_request.is_disconnected():
+        print(f"Client for {conversation_id} disconnected before the run started")
+        cancellation_stats.record_cancelled(token)
+        return JSONResponse(status_code=499, content={"detail": "Client disconnected"})
+
+    # Copy the history so a failed run never leaves the stored conversation half-updated
+    messages = list(conversations.get(conversation_id, []))
+    messages.append({"role": "user", "content": message})
+
+    # Create the initial state
+    state = AgentState(messages=messages)
+
+    # Debug environment variables - show status for all keys
+    print("\n----- Using API Keys -----")
+    for key_name in API_KEYS:
+        key_value = os.environ.get(key_name, 'Not set')
+        mask = key_value[:5] + '...' + key_value[-4:] if len(key_value) > 10 else 'Not set or too short'
+        print(f"Using {key_name}: {mask}")
+    print("--------------------------\n")
+
+    # Check if essential keys are valid before proceeding
+    openai_key = os.environ.get('OPENAI_API_KEY', 'Not set')
+    if openai_key == 'Not set' or len(openai_key) < 10:
+        raise ValueError("OPENAI_API_KEY is not properly set in the environment")
+
+    # Configure with the model
+    config = {
+        "configurable": {"model_name": model_name, "mode": mode},
+        "callbacks": [CancellationCallback(token)],
+    }
+
+    # Latest messages seen while streaming, kept if the run is cancelled
+    progress = {"messages": messages}
+
+    async def run_graph():
+        with cancellation_scope(token):
+            # Use the compiled graph instead of workflow
+            async for values in graph.astream(state, config=config, stream_mode="values"):
+                progress["messages"] = values["messages"]
+        return progress["messages"]
+
+    # Invoke the agent
+    graph_task = asyncio.create_task(run_graph())
+    watcher = asyncio.create_task(watch_disconnect(http_request, graph_task, token))
+    try:
+        print(f"Invoking graph with model: {model_name}, mode: {mode}")
+        try:
+            # Get the updated messages
+            updated_messages = await graph_task
+        except (asyncio.CancelledError, RunCancelled):
+            if not token.cancelled:
+                # The request itself was cancelled (e.g. server shutdown), not the run
+                raise
+            cancelled_messages = partial_history(progress["messages"])
+            cancelled_messages.append({"role": "assistant", "content": "[Run cancelled because the client disconnected]"})
+            conversations[conversation_id] = cancelled_messages
+            cancellation_stats.record_cancelled(token)
+            print(f"Graph run for {conversation_id} cancelled after {token.llm_calls} LLM calls and {token.tool_calls} tool calls")
+            return JSONResponse(status_code=499, content={"detail": "Client disconnected"})
+        print("Graph invocation successful")
+        cancellation_stats.record_completed(token)
+
+        # Save the updated conversation
+        conversations[conversation_id] = updated_messages
+
+        # Return results
+        return await chat_response({
+            "conversation_id": conversation_id,
+            "messages": updated_messages
+        })
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"Error during workflow invocation: {str(e)}")
+        print(error_trace)
+
+        # Create a graceful error response
+        error_message = {"role": "assistant", "content": f"I'm sorry, I encountered an error: {str(e)}. Please try again."}
+        messages.append(error_message)
+        conversations[conversation_id] = messages
+
+        return JSONResponse(
+            status_code=200,  # Return 200 but with error message to client
+            content={
+                "conversation_id": conversation_id,
+                "messages": messages,
+                "error": str(e)
+            }
+        )
+    finally:
+        watcher.cancel()
+        if not graph_task.done():
+            graph_task.cancel()
+
 @app.post("/chat")
-async def chat(request: Dict[str, Any] = Body(...)):
+async def chat(http_request: Request, request: Dict[str, Any] = Body(...)):
     """
     Chat with the agent.
     
@@ -93,6 +247,7 @@ async def chat(request: Dict[str, Any] = Body(...)):
     - conversation_id: Optional ID to continue a conversation
     - message: The user's message
     - model: Optional model to use ("openai" or "anthropic")
+    - mode: Optional graph mode ("chat" or "deep_research")
     """
     print("POST /chat endpoint called with body:", request)
     
@@ -101,80 +256,36 @@ async def chat(request: Dict[str, Any] = Body(...)):
         conversation_id = request.get("conversation_id", None)
         message = request.get("message")
         model_name = request.get("model", "openai")
+        mode = request.get("mode", "chat")
         
         # Debug logging
-        print(f"Received chat request: model={model_name}, message={message}, conv_id={conversation_id}")
+        print(f"Received chat request: model={model_name}, mode={mode}, message={message}, conv_id={conversation_id}")
         
         if not message:
             raise HTTPException(status_code=400, detail="Message is required")
+        if mode not in get_args(GraphMode):
+            raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}', expected one of {list(get_args(GraphMode))}")
         
         # Get or create conversation history
-        if conversation_id and conversation_id in conversations:
-            messages = conversations[conversation_id]
-        else:
+        if not (conversation_id and conversation_id in conversations):
             # Start a new conversation
-            messages = []
-            conversation_id = f"conv_{len(conversations) + 1}"
-        
-        # Add user message to history
-        messages.append({"role": "user", "content": message})
-        
-        # Create the initial state
-        state = AgentState(messages=messages)
-        
-        # Debug environment variables - show status for all keys
-        print("\n----- Using API Keys -----")
-        for key_name in API_KEYS:
-            key_value = os.environ.get(key_name, 'Not set')
-            mask = key_value[:5] + '...' + key_value[-4:] if len(key_value) > 10 else 'Not set or too short'
-            print(f"Using {key_name}: {mask}")
-        print("--------------------------\n")
+            conversation_id = new_conversation_id()
         
-        # Check if essential keys are valid before proceeding
-        openai_key = os.environ.get('OPENAI_API_KEY', 'Not set')
-        if openai_key == 'Not set' or len(openai_key) < 10:
-            raise ValueError("OPENAI_API_KEY is not properly set in the environment")
-            
-        # Configure with the model
-        config = {"configurable": {"model_name": model_name}}
-        
-        # Invoke the agent
-        try:
-            print(f"Invoking graph with model: {model_name}")
-            # Use the compiled graph instead of workflow
-            result = graph.invoke(state, config=config)
-            print("Graph invocation successful")
-            
-            # Get the updated messages
-            updated_messages = result["messages"]
-            
-            # Save the updated conversation
-            conversations[conversation_id] = updated_messages
-            
-            # Return results
-            return {
-                "conversation_id": conversation_id,
-                "messages": updated_messages
-            }
-        except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"Error during workflow invocation: {str(e)}")
-            print(error_trace)
-            
-            # Create a graceful error response
-            error_message = {"role": "assistant", "content": f"I'm sorry, I encountered an error: {str(e)}. Please try again."}
-            messages.append(error_message)
-            conversations[conversation_id] = messages
-            
-            return JSONResponse(
-                status_code=200,  # Return 200 but with error message to client
-                content={
-                    "conversation_id": conversation_id,
-                    "messages": messages,
-                    "error": str(e)
-                }
-            )
+        # Requests for the same conversation run one at a time, and only a limited
+        # number of graph runs execute at once across all conversations
+        async with admission.conversation(conversation_id):
+            async with admission.slot():
+                return await run_chat(http_request, conversation_id, message, model_name, mode)
+    except HTTPException:
+        # Let FastAPI turn validation errors into their 4xx response
+        raise
+    except AdmissionRejected as e:
+        print(f"Rejected chat request for {conversation_id}: {e.detail}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": e.detail},
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -208,6 +319,15 @@ async def health_check():
     status["api"] = "healthy"
     return status
 
+@app.get("/metrics")
+async def metrics():
+    """Report admission control, worker pool and cancellation metrics"""
+    return {
+        "admission": admission.metrics(),
+        "workers": worker_pool.metrics(),
+        "cancellation": cancellation_stats.metrics(),
+    }
+
 @app.get("/api-status")
 async def api_status():
     """Get detailed status of configured APIs"""
@@ -5,25 +5,60 @@ from my_agent.utils.auth_setup import api_keys
 from typing import TypedDict, Literal
 import os
 
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from my_agent.utils.nodes import call_model, should_continue, tool_node
-from my_agent.utils.state import AgentState
+from my_agent.utils.nodes import call_model, acall_model, should_continue, tool_node, atool_node
+from my_agent.utils.deep_research import (
+    plan_research, aplan_research, fan_out_research, research_branch, aresearch_branch, reduce_findings,
+    synthesize_answer, asynthesize_answer
+)
+from my_agent.utils.state import ResearchState
+
+# "chat" is the agent/action tool loop, "deep_research" fans sub-queries out in parallel
+GraphMode = Literal["chat", "deep_research"]
 
 # Define the config
 class GraphConfig(TypedDict):
     model_name: Literal["anthropic", "openai"]
+    mode: GraphMode
+    max_sub_queries: int
 
 
 # Define a new graph
-workflow = StateGraph(AgentState, config_schema=GraphConfig)
+workflow = StateGraph(ResearchState, config_schema=GraphConfig)
+
+# Define the two nodes we will cycle between.
+# Nodes that call the model or tools have an async version, used by `ainvoke`/`astream`,
+# so cancelling a run also aborts its in-flight HTTP requests.
+workflow.add_node("agent", RunnableLambda(call_model, afunc=acall_model))
+workflow.add_node("action", RunnableLambda(tool_node, afunc=atool_node))
+
+# Nodes for the deep research mode
+workflow.add_node("plan", RunnableLambda(plan_research, afunc=aplan_research))
+workflow.add_node("research_branch", RunnableLambda(research_branch, afunc=aresearch_branch))
+workflow.add_node("reduce", reduce_findings)
+workflow.add_node("synthesize", RunnableLambda(synthesize_answer, afunc=asynthesize_answer))
+
 
-# Define the two nodes we will cycle between
-workflow.add_node("agent", call_model)
-workflow.add_node("action", tool_node)
+def select_mode(state, config):
+    return config.get("configurable", {}).get("mode", "chat")
+
+
+# The entrypoint depends on the mode: `agent` for chat, `plan` for deep research
+workflow.set_conditional_entry_point(
+    select_mode,
+    {
+        "chat": "agent",
+        "deep_research": "plan",
+    },
+)
 
-# Set the entrypoint as `agent`
-# This means that this node is the first one called
-workflow.set_entry_point("agent")
+# `plan` sends every sub-query to its own `research_branch`, which run in parallel.
+# `reduce` runs once all branches have finished, then `synthesize` writes the answer.
+workflow.add_conditional_edges("plan", fan_out_research, ["research_branch"])
+workflow.add_edge("research_branch", "reduce")
+workflow.add_edge("reduce", "synthesize")
+workflow.add_edge("synthesize", END)
 
 # We now add a conditional edge
 workflow.add_conditional_edges(
@@ -0,0 +1,160 @@
+"""
+Admission control for graph runs started by the API.
+
+Limits how many graph runs execute at once, keeps a bounded queue of waiting
+requests and serializes requests that target the same conversation. When the
+service is saturated, requests are rejected immediately with a retry hint
+instead of piling up until they time out.
+"""
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", 4))
+MAX_QUEUED_RUNS = int(os.environ.get("MAX_QUEUED_RUNS", 16))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("QUEUE_TIMEOUT_SECONDS", 30))
+# Requests for one conversation that may wait behind the one currently running
+MAX_PENDING_PER_CONVERSATION = int(os.environ.get("MAX_PENDING_PER_CONVERSATION", 2))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted. Maps directly to an HTTP response."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS, max_queued: int = MAX_QUEUED_RUNS,
+                 queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+                 max_pending_per_conversation: int = MAX_PENDING_PER_CONVERSATION):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_pending_per_conversation = max_pending_per_conversation
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._conversation_locks: Dict[str, asyncio.Lock] = {}
+        self._conversation_users: Dict[str, int] = {}
+        self.running = 0
+        self.queued = 0
+        # Requests waiting for another request on the same conversation to finish
+        self.conversation_waiting = 0
+        self.stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_conversation_busy": 0,
+            "rejected_conversation_timeout": 0,
+            # Time spent behind another request on the same conversation
+            "conversation_waits": 0,
+            "total_conversation_wait_seconds": 0.0,
+            "max_conversation_wait_seconds": 0.0,
+            # Time spent waiting for a global run slot
+            "slot_waits": 0,
+            "total_slot_wait_seconds": 0.0,
+            "max_slot_wait_seconds": 0.0,
+            "total_run_seconds": 0.0,
+            "completed": 0,
+        }
+
+    def _record_wait(self, kind: str, waited: float):
+        self.stats[f"{kind}_waits"] += 1
+        self.stats[f"total_{kind}_wait_seconds"] += waited
+        self.stats[f"max_{kind}_wait_seconds"] = max(self.stats[f"max_{kind}_wait_seconds"], waited)
+
+    def _retry_after(self) -> int:
+        # Rough estimate: average run time multiplied by how many batches are ahead
+        completed = self.stats["completed"]
+        avg_run = self.stats["total_run_seconds"] / completed if completed else 10.0
+        batches_ahead = (self.queued + self.conversation_waiting + self.running) / self.max_concurrent
+        return max(1, int(avg_run * max(batches_ahead, 1)))
+
+    @asynccontextmanager
+    async def conversation(self, conversation_id: str):
+        """Serialize requests for the same conversation."""
+        if self._conversation_users.get(conversation_id, 0) > self.max_pending_per_conversation:
+            self.stats["rejected_conversation_busy"] += 1
+            raise AdmissionRejected(429, f"Too many pending requests for conversation {conversation_id}",
+                                    self._retry_after())
+
+        lock = self._conversation_locks.setdefault(conversation_id, asyncio.Lock())
+        self._conversation_users[conversation_id] = self._conversation_users.get(conversation_id, 0) + 1
+        try:
+            self.conversation_waiting += 1
+            wait_start = time.monotonic()
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected_conversation_timeout"] += 1
+                raise AdmissionRejected(429, f"Timed out waiting for conversation {conversation_id}, please retry later",
+                                        self._retry_after())
+            finally:
+                self.conversation_waiting -= 1
+            self._record_wait("conversation", time.monotonic() - wait_start)
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._conversation_users[conversation_id] -= 1
+            if self._conversation_users[conversation_id] == 0:
+                # Nobody else is waiting, drop the lock so the dict doesn't grow forever
+                del self._conversation_users[conversation_id]
+                del self._conversation_locks[conversation_id]
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for one of the global graph run slots, or fail fast when saturated."""
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            self.stats["rejected_queue_full"] += 1
+            raise AdmissionRejected(503, "Server is at capacity, please retry later", self._retry_after())
+
+        self.queued += 1
+        wait_start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_queue_timeout"] += 1
+            raise AdmissionRejected(503, "Timed out waiting for capacity, please retry later",
+                                    self._retry_after())
+        finally:
+            self.queued -= 1
+
+        self._record_wait("slot", time.monotonic() - wait_start)
+        self.stats["admitted"] += 1
+        self.running += 1
+        run_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.stats["completed"] += 1
+            self.stats["total_run_seconds"] += time.monotonic() - run_start
+            self._semaphore.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        conversation_waits = self.stats["conversation_waits"]
+        slot_waits = self.stats["slot_waits"]
+        completed = self.stats["completed"]
+        return {
+            "running": self.running,
+            "queue_depth": self.queued + self.conversation_waiting,
+            "slot_waiting": self.queued,
+            "conversation_waiting": self.conversation_waiting,
+            "active_conversations": len(self._conversation_locks),
+            "max_concurrent_runs": self.max_concurrent,
+            "max_queued_runs": self.max_queued,
+            "avg_conversation_wait_seconds": (self.stats["total_conversation_wait_seconds"] / conversation_waits
+                                              if conversation_waits else 0.0),
+            "avg_slot_wait_seconds": self.stats["total_slot_wait_seconds"] / slot_waits if slot_waits else 0.0,
+            "avg_run_seconds": self.stats["total_run_seconds"] / completed if completed else 0.0,
+            **self.stats,
+        }
+
+
+admission = AdmissionController()
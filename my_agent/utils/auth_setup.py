@@ -32,7 +32,6 @@ def setup_environment():
         "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY"),
         "SERPER_API_KEY": os.environ.get("SERPER_API_KEY"),
         "METAPHOR_API_KEY": os.environ.get("METAPHOR_API_KEY"),
-        "BROWSERLESS_API_KEY": os.environ.get("BROWSERLESS_API_KEY"),
         "APIFY_API_KEY": os.environ.get("APIFY_API_KEY"),
         "LANGCHAIN_API_KEY": os.environ.get("LANGCHAIN_API_KEY"),
         "LANGSMITH_API_KEY": os.environ.get("LANGSMITH_API_KEY")
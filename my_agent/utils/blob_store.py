@@ -0,0 +1,172 @@
+"""
+Content-addressed storage for large tool outputs.
+
+Tool results (webpages, Wikipedia extracts, search dumps) can be tens of kilobytes.
+Instead of carrying them inline in AgentState, large ToolMessage bodies are stored
+here once, keyed by their SHA-256, and the state only keeps a small BlobRef.
+The full body is fetched again when the context for a model call is built.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Sequence, List
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from my_agent.utils.state import BlobRef
+
+# Tool outputs larger than this many characters are moved out of the state
+INLINE_LIMIT = int(os.environ.get("BLOB_INLINE_LIMIT", 4000))
+# Number of characters kept inline so the conversation stays readable
+PREVIEW_CHARS = int(os.environ.get("BLOB_PREVIEW_CHARS", 500))
+# Bytes kept in memory before the least recently used blobs spill to disk
+MEMORY_LIMIT = int(os.environ.get("BLOB_MEMORY_LIMIT", 64 * 1024 * 1024))
+# Bytes kept on disk before the least recently used spilled blobs are deleted.
+# A conversation whose blob was deleted falls back to the preview kept in its state.
+DISK_LIMIT = int(os.environ.get("BLOB_DISK_LIMIT", 1024 * 1024 * 1024))
+BLOB_DIR = os.environ.get("BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "research_agent_blobs"))
+
+
+class BlobStore:
+    """In-memory LRU of blobs that spills the coldest entries to disk, itself capped in size."""
+
+    def __init__(self, directory: str = BLOB_DIR, memory_limit: int = MEMORY_LIMIT, disk_limit: int = DISK_LIMIT):
+        self.directory = Path(directory)
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # Measured from the directory on the first spill, it may hold blobs from earlier runs
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def put(self, content: str) -> str:
+        """Store content and return its hash. Identical content is stored once."""
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return digest
+            path = self._path(digest)
+            if path.exists():
+                # Referenced again, so it shouldn't be the next one the disk sweep deletes
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+                else:
+                    return digest
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+            self._spill()
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the stored content, or None if the blob is unknown."""
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data.decode("utf-8")
+        path = self._path(digest)
+        try:
+            data = path.read_bytes()
+            # Reading refreshes the mtime, which the disk sweep uses as last access time
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data.decode("utf-8")
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / digest
+
+    def _blob_files(self):
+        return [path for path in self.directory.glob("*/*") if path.suffix != ".tmp"]
+
+    def _sweep_disk(self):
+        # Called with the lock held; delete the least recently used blobs until under the limit
+        files = []
+        for path in self._blob_files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        self._disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self._disk_bytes <= self.disk_limit:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+
+    def _spill(self):
+        # Called with the lock held; always keep at least the newest blob in memory
+        if self._disk_bytes is None and self._memory_bytes > self.memory_limit:
+            self._sweep_disk()
+        while self._memory_bytes > self.memory_limit and len(self._memory) > 1:
+            digest, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+            path = self._path(digest)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self._disk_bytes += len(data)
+            except OSError as e:
+                # Keep the blob in memory rather than losing it
+                print(f"Error spilling blob {digest[:12]} to disk: {e}")
+                self._memory[digest] = data
+                self._memory.move_to_end(digest, last=False)
+                self._memory_bytes += len(data)
+                break
+        if self._disk_bytes is not None and self._disk_bytes > self.disk_limit:
+            self._sweep_disk()
+
+
+blob_store = BlobStore()
+
+
+def offload_message(message: BaseMessage, store: BlobStore = blob_store) -> BaseMessage:
+    """Replace a large ToolMessage body with a preview and a BlobRef."""
+    if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+        return message
+    if "blob_ref" in message.additional_kwargs or len(message.content) <= INLINE_LIMIT:
+        return message
+
+    content = message.content
+    ref: BlobRef = {
+        "hash": store.put(content),
+        "size": len(content),
+        "preview": content[:PREVIEW_CHARS],
+    }
+    placeholder = (
+        f"{ref['preview']}\n"
+        f"[... {ref['size'] - PREVIEW_CHARS} more characters stored as blob {ref['hash'][:12]}]"
+    )
+    return message.model_copy(update={
+        "content": placeholder,
+        "additional_kwargs": {**message.additional_kwargs, "blob_ref": ref},
+    })
+
+
+def hydrate_messages(messages: Sequence[BaseMessage], store: BlobStore = blob_store) -> List[BaseMessage]:
+    """Return messages with blob references swapped back for their full content."""
+    hydrated = []
+    for message in messages:
+        ref = getattr(message, "additional_kwargs", {}).get("blob_ref")
+        if ref:
+            content = store.get(ref["hash"])
+            if content is not None:
+                message = message.model_copy(update={"content": content})
+            else:
+                print(f"Blob {ref['hash'][:12]} not found, using preview only")
+        hydrated.append(message)
+    return hydrated
@@ -0,0 +1,136 @@
+"""
+Cooperative cancellation of graph runs.
+
+The API gives every run a CancellationToken. When the client disconnects the token is
+cancelled and the graph task is cancelled with it: async LLM and tool calls are aborted
+right away, and CancellationCallback refuses to start any further LLM or tool call from
+code still running in worker threads. Long running tools can also check the token
+themselves with raise_if_cancelled().
+"""
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class RunCancelled(Exception):
+    """Raised inside a graph run whose client has gone away."""
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        # Work done by the run so far, used to estimate what a cancellation saved
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.tokens = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise RunCancelled("Run cancelled because the client disconnected")
+
+    def count(self, llm_calls: int = 0, tool_calls: int = 0, tokens: int = 0):
+        with self._lock:
+            self.llm_calls += llm_calls
+            self.tool_calls += tool_calls
+            self.tokens += tokens
+
+
+_current_token: contextvars.ContextVar[Optional[CancellationToken]] = contextvars.ContextVar(
+    "cancellation_token", default=None
+)
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken):
+    """Make token visible to raise_if_cancelled() in this context and the threads it starts."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def raise_if_cancelled():
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class CancellationCallback(BaseCallbackHandler):
+    """Stops new LLM and tool calls once the token is cancelled, and counts the work done."""
+
+    raise_error = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.token.raise_if_cancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.token.raise_if_cancelled()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.token.raise_if_cancelled()
+
+    def on_llm_end(self, response, **kwargs):
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                tokens += usage.get("total_tokens", 0)
+        self.token.count(llm_calls=1, tokens=tokens)
+
+    def on_tool_end(self, output, **kwargs):
+        self.token.count(tool_calls=1)
+
+
+class CancellationStats:
+    """Counts cancelled runs and estimates the calls and tokens they didn't spend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed_runs = 0
+        self.cancelled_runs = 0
+        self._completed_totals = {"llm_calls": 0, "tool_calls": 0, "tokens": 0}
+        self.saved = {"llm_calls": 0.0, "tool_calls": 0.0, "tokens": 0.0}
+
+    def record_completed(self, token: CancellationToken):
+        with self._lock:
+            self.completed_runs += 1
+            for key in self._completed_totals:
+                self._completed_totals[key] += getattr(token, key)
+
+    def record_cancelled(self, token: CancellationToken):
+        with self._lock:
+            self.cancelled_runs += 1
+            if not self.completed_runs:
+                return
+            # Estimate: an average completed run minus what this run had already used
+            for key, total in self._completed_totals.items():
+                average = total / self.completed_runs
+                self.saved[key] += max(0.0, average - getattr(token, key))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "completed_runs": self.completed_runs,
+                "cancelled_runs": self.cancelled_runs,
+                "estimated_llm_calls_saved": round(self.saved["llm_calls"], 1),
+                "estimated_tool_calls_saved": round(self.saved["tool_calls"], 1),
+                "estimated_tokens_saved": int(self.saved["tokens"]),
+            }
+
+
+cancellation_stats = CancellationStats()
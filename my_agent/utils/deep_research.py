@@ -0,0 +1,260 @@
+"""
+Nodes for the map-reduce "deep research" graph mode.
+
+plan_research splits the question into sub-queries, fan_out_research sends each one
+to its own research_branch (run in parallel by LangGraph), reduce_findings merges
+and dedupes what the branches found, and synthesize_answer makes one final model call.
+"""
+import re
+import asyncio
+import hashlib
+from typing import List, Dict, Any
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.types import Send
+
+from my_agent.utils.nodes import _get_base_model, select_tool, tools
+from my_agent.utils.blob_store import hydrate_messages
+from my_agent.utils.cancellation import RunCancelled
+
+DEFAULT_MAX_SUB_QUERIES = 4
+# Characters kept per finding and across all findings passed to the final synthesis
+FINDING_CHARS = 1500
+TOTAL_NOTES_CHARS = 24000
+# Earlier messages shown to the planner so follow-up questions can be resolved, and their maximum length
+PLANNER_HISTORY_MESSAGES = 6
+PLANNER_HISTORY_CHARS = 1000
+
+
+class ResearchPlan(BaseModel):
+    """Sub-queries that together answer the user's question."""
+    sub_queries: List[str] = Field(description="Short, self-contained search queries, one per facet of the question")
+
+
+PLANNER_PROMPT = """You are planning research for a complex question.
+The question may be a follow-up, read it in the context of the conversation so far.
+Break the question into at most {max_sub_queries} independent search queries that together cover all of its facets.
+Each query must make sense on its own, without the other queries or the conversation, so name the subject explicitly instead of writing "it" or "they".
+Do not answer the question."""
+
+SYNTHESIS_PROMPT = """You are an AI research assistant.
+Answer the user's latest question using the research notes provided below.
+Combine the notes into one coherent answer, resolve contradictions where possible and cite sources by their URL when one is given.
+If the notes don't cover part of the question, say so."""
+
+
+def _latest_question(messages) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content if isinstance(message.content, str) else str(message.content)
+    return ""
+
+
+def _recent_history(messages) -> str:
+    """Recent user and assistant turns before the latest question, as plain text."""
+    turns = []
+    for message in messages:
+        # Tool calls and tool results are skipped, the answers built from them are enough context
+        if not isinstance(message, (HumanMessage, AIMessage)) or not isinstance(message.content, str):
+            continue
+        if message.content.strip():
+            role = "User" if isinstance(message, HumanMessage) else "Assistant"
+            turns.append(f"{role}: {_compact(message.content, PLANNER_HISTORY_CHARS)}")
+    # The last user turn is the question itself
+    return "\n".join(turns[:-1][-PLANNER_HISTORY_MESSAGES:])
+
+
+def _planner_prompt(messages, max_sub_queries: int):
+    question = _latest_question(messages)
+    history = _recent_history(messages)
+    content = f"Conversation so far:\n{history}\n\nQuestion: {question}" if history else question
+    return [
+        {"role": "system", "content": PLANNER_PROMPT.format(max_sub_queries=max_sub_queries)},
+        {"role": "user", "content": content},
+    ]
+
+
+def _plan_result(question: str, plan, max_sub_queries: int):
+    sub_queries = list(dict.fromkeys(q.strip() for q in plan.sub_queries if q.strip())) if plan else []
+    sub_queries = sub_queries[:max_sub_queries] or [question]
+    print(f"Deep research plan: {sub_queries}")
+    # Start from no findings, earlier turns on the same thread may have left some behind
+    return {"sub_queries": sub_queries, "findings": None}
+
+
+def plan_research(state, config):
+    configurable = config.get("configurable", {})
+    model_name = configurable.get("model_name", "openai")
+    max_sub_queries = configurable.get("max_sub_queries", DEFAULT_MAX_SUB_QUERIES)
+    question = _latest_question(state["messages"])
+
+    try:
+        planner = _get_base_model(model_name).with_structured_output(ResearchPlan)
+        plan = planner.invoke(_planner_prompt(state["messages"], max_sub_queries))
+    except RunCancelled:
+        raise
+    except Exception as e:
+        print(f"Error planning research, searching for the question directly: {e}")
+        plan = None
+    return _plan_result(question, plan, max_sub_queries)
+
+
+async def aplan_research(state, config):
+    configurable = config.get("configurable", {})
+    model_name = configurable.get("model_name", "openai")
+    max_sub_queries = configurable.get("max_sub_queries", DEFAULT_MAX_SUB_QUERIES)
+    question = _latest_question(state["messages"])
+
+    try:
+        model = await asyncio.to_thread(_get_base_model, model_name)
+        plan = await model.with_structured_output(ResearchPlan).ainvoke(_planner_prompt(state["messages"], max_sub_queries))
+    except RunCancelled:
+        raise
+    except Exception as e:
+        print(f"Error planning research, searching for the question directly: {e}")
+        plan = None
+    return _plan_result(question, plan, max_sub_queries)
+
+
+def fan_out_research(state):
+    # One parallel branch per sub-query
+    return [Send("research_branch", {"query": query}) for query in state["sub_queries"]]
+
+
+def _pick_search_tool(query: str):
+    by_name = {tool.name: tool for tool in tools}
+    preferred = by_name.get(select_tool(query))
+    if preferred is not None and preferred.name != "browse_web":
+        return preferred
+    for tool in tools:
+        if tool.name != "browse_web":
+            return tool
+    return None
+
+
+def _compact(text: str, max_chars: int = FINDING_CHARS) -> str:
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + " ..."
+    return text
+
+
+def _to_findings(query: str, tool_name: str, raw: Any) -> List[Dict[str, str]]:
+    """Normalize the different tool result shapes into a list of findings."""
+    if isinstance(raw, dict):
+        if "results" in raw:
+            return _to_findings(query, tool_name, raw["results"])
+        if "error" in raw:
+            print(f"Research branch '{query}' failed in {tool_name}: {raw['error']}")
+            return []
+        raw = [raw]
+    if isinstance(raw, list):
+        findings = []
+        for item in raw:
+            if isinstance(item, dict):
+                # Fall back to the title so a result without text still brings its URL to the notes
+                content = (item.get("content") or item.get("snippet") or item.get("extract")
+                           or item.get("title") or "")
+                source = item.get("url") or item.get("link") or tool_name
+            else:
+                content, source = item, tool_name
+            if content:
+                findings.append({"query": query, "source": source, "content": _compact(content)})
+        return findings
+    if raw:
+        return [{"query": query, "source": tool_name, "content": _compact(raw)}]
+    return []
+
+
+def _branch_result(query: str, tool, raw: Any):
+    findings = _to_findings(query, tool.name, raw)
+    print(f"Research branch '{query}' used {tool.name}, {len(findings)} findings")
+    return {"findings": findings}
+
+
+def research_branch(branch_state, config):
+    query = branch_state["query"]
+    tool = _pick_search_tool(query)
+    if tool is None:
+        return {"findings": []}
+    try:
+        raw = tool.invoke(query, config)
+    except RunCancelled:
+        raise
+    except Exception as e:
+        print(f"Research branch '{query}' failed in {tool.name}: {e}")
+        return {"findings": []}
+    return _branch_result(query, tool, raw)
+
+
+async def aresearch_branch(branch_state, config):
+    query = branch_state["query"]
+    tool = _pick_search_tool(query)
+    if tool is None:
+        return {"findings": []}
+    try:
+        raw = await tool.ainvoke(query, config)
+    except RunCancelled:
+        raise
+    except Exception as e:
+        print(f"Research branch '{query}' failed in {tool.name}: {e}")
+        return {"findings": []}
+    return _branch_result(query, tool, raw)
+
+
+def _canonical_source(source: str) -> str:
+    parts = urlsplit(source)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+def reduce_findings(state):
+    notes = []
+    seen_sources = set()
+    seen_content = set()
+    total = 0
+    for finding in state.get("findings", []):
+        # The same page found by several branches is kept once
+        if "://" in finding["source"]:
+            source = _canonical_source(finding["source"])
+            if source in seen_sources:
+                continue
+            seen_sources.add(source)
+        content_key = hashlib.sha1(finding["content"].lower().encode("utf-8")).hexdigest()
+        if content_key in seen_content:
+            continue
+        seen_content.add(content_key)
+        if total + len(finding["content"]) > TOTAL_NOTES_CHARS:
+            break
+        total += len(finding["content"])
+        notes.append(finding)
+    print(f"Merged {len(state.get('findings', []))} findings into {len(notes)} notes")
+    return {"notes": notes}
+
+
+def _synthesis_prompt(state):
+    notes = "\n\n".join(
+        f"[{i}] ({note['source']}) {note['content']}" for i, note in enumerate(state.get("notes", []), 1)
+    ) or "No research notes were found."
+    system_prompt = f"{SYNTHESIS_PROMPT}\n\nResearch notes:\n\n{notes}"
+    return [{"role": "system", "content": system_prompt}] + hydrate_messages(state["messages"])
+
+
+def synthesize_answer(state, config):
+    model_name = config.get("configurable", {}).get("model_name", "openai")
+    model = _get_base_model(model_name)
+    response = model.invoke(_synthesis_prompt(state))
+    return {"messages": [response]}
+
+
+async def asynthesize_answer(state, config):
+    model_name = config.get("configurable", {}).get("model_name", "openai")
+    model = await asyncio.to_thread(_get_base_model, model_name)
+    # Hydrating blobs may read spilled ones from disk, keep that off the event loop
+    messages = await asyncio.to_thread(_synthesis_prompt, state)
+    response = await model.ainvoke(messages)
+    return {"messages": [response]}
@@ -0,0 +1,175 @@
+"""
+Federated meta-search across all configured search providers.
+
+The query is sent to every provider at once. Results are normalized to
+{"title", "url", "snippet"}, deduplicated by canonical URL and ranked with
+reciprocal-rank fusion. Providers that are slow to answer are hedged with a backup
+request. The search returns once a quorum of providers has answered (plus a short
+grace period for stragglers) or the deadline passes, so one slow provider can't hold
+up the whole call.
+"""
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from langchain.tools.base import BaseTool
+
+from my_agent.utils.cancellation import raise_if_cancelled
+
+FEDERATED_QUORUM = int(os.environ.get("FEDERATED_QUORUM", 2))
+FEDERATED_DEADLINE_SECONDS = float(os.environ.get("FEDERATED_DEADLINE_SECONDS", 8))
+# Providers that haven't answered after this many seconds get a second, backup request;
+# whichever of the two answers first is used. 0 disables hedging.
+FEDERATED_HEDGE_SECONDS = float(os.environ.get("FEDERATED_HEDGE_SECONDS", 3))
+# How long to keep waiting for the remaining providers once the quorum is reached
+FEDERATED_GRACE_SECONDS = float(os.environ.get("FEDERATED_GRACE_SECONDS", 1))
+FEDERATED_MAX_RESULTS = int(os.environ.get("FEDERATED_MAX_RESULTS", 8))
+# Longest wait between checks for a cancelled run
+CANCEL_POLL_SECONDS = 0.25
+# Standard reciprocal-rank fusion constant
+RRF_K = 60
+
+TRACKING_PARAMS = {"gclid", "fbclid", "ref", "ref_src"}
+
+FEDERATED_WORKERS = int(os.environ.get("FEDERATED_WORKERS", 16))
+
+# Provider calls get their own threads. The tool itself runs on the loop's default executor
+# (the worker pool's I/O threads); queueing its provider calls behind it there could starve
+# the pool, with every thread waiting on calls that can't start.
+_provider_executor = ThreadPoolExecutor(max_workers=FEDERATED_WORKERS, thread_name_prefix="federated-search")
+
+# Called with the query and the seconds left until the deadline, which it must use as its request timeout
+SearchProvider = Callable[[str, float], List[Dict[str, str]]]
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so the same page from different providers compares equal."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if not host:
+        return ""
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/")
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    )
+    return f"{host}{path}" + (f"?{urlencode(query)}" if query else "")
+
+
+def fuse_results(responses: Dict[str, List[Dict[str, str]]], max_results: int = FEDERATED_MAX_RESULTS) -> List[Dict[str, Any]]:
+    """Merge ranked result lists with reciprocal-rank fusion, deduplicating by canonical URL."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for provider, results in responses.items():
+        for rank, result in enumerate(results, 1):
+            key = canonical_url(result.get("url", ""))
+            if not key:
+                continue
+            entry = merged.setdefault(key, {
+                "title": result.get("title", ""),
+                "url": result["url"],
+                "snippet": "",
+                "providers": [],
+                "score": 0.0,
+            })
+            if provider in entry["providers"]:
+                continue
+            entry["providers"].append(provider)
+            entry["score"] += 1.0 / (RRF_K + rank)
+            # Keep the most informative snippet
+            snippet = result.get("snippet") or ""
+            if len(snippet) > len(entry["snippet"]):
+                entry["snippet"] = snippet
+    ranked = sorted(merged.values(), key=lambda entry: entry["score"], reverse=True)
+    for entry in ranked:
+        entry["score"] = round(entry["score"], 5)
+    return ranked[:max_results]
+
+
+def _call_provider(search: SearchProvider, query: str, deadline_at: float) -> List[Dict[str, str]]:
+    # The timeout is worked out when the call starts, it may have waited for a free thread
+    timeout = deadline_at - time.monotonic()
+    if timeout <= 0:
+        raise TimeoutError("deadline passed before the provider was called")
+    return search(query, timeout)
+
+
+def federated_search(query: str, providers: Dict[str, SearchProvider], quorum: int = FEDERATED_QUORUM,
+                     deadline: float = FEDERATED_DEADLINE_SECONDS, hedge: float = FEDERATED_HEDGE_SECONDS,
+                     grace: float = FEDERATED_GRACE_SECONDS) -> Dict[str, Any]:
+    started_at = time.monotonic()
+    deadline_at = started_at + deadline
+    # Providers still without an answer get one backup request at hedge_at
+    hedge_at = started_at + hedge if hedge > 0 else None
+    futures: Dict[Future, str] = {}
+
+    def call(name: str) -> Future:
+        future = _provider_executor.submit(_call_provider, providers[name], query, deadline_at)
+        futures[future] = name
+        return future
+
+    pending = {call(name) for name in providers}
+    quorum = min(quorum, len(providers))
+    grace_at = None
+    responses: Dict[str, List[Dict[str, str]]] = {}
+    failed: List[str] = []
+    hedged: List[str] = []
+
+    while pending:
+        stop_at = deadline_at if grace_at is None else min(deadline_at, grace_at)
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        if hedge_at is not None and now >= hedge_at:
+            hedge_at = None
+            hedged = sorted({futures[future] for future in pending})
+            pending |= {call(name) for name in hedged}
+            print(f"Federated search: sent backup requests to slow providers {hedged}")
+        raise_if_cancelled()
+        wake_at = stop_at if hedge_at is None else min(stop_at, hedge_at)
+        done, pending = wait(pending, timeout=min(wake_at - now, CANCEL_POLL_SECONDS), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            if name in responses:
+                continue
+            try:
+                responses[name] = future.result()
+            except Exception as e:
+                # Only a failure if the other request to this provider failed too
+                if not any(futures[other] == name for other in pending):
+                    print(f"Federated search: {name} failed: {e}")
+                    failed.append(name)
+                continue
+            # The first answer wins, the other request to this provider is ignored
+            pending = {other for other in pending if futures[other] != name}
+        if grace_at is None and len(responses) >= quorum:
+            grace_at = time.monotonic() + grace
+
+    # Slow providers are dropped; their calls stop at their request timeout and the result is ignored
+    dropped = sorted({futures[future] for future in pending})
+    if dropped:
+        print(f"Federated search: dropped slow providers {dropped}")
+    return {
+        "results": fuse_results(responses),
+        "providers": sorted(responses),
+        "failed": failed,
+        "dropped": dropped,
+        "hedged": hedged,
+    }
+
+
+class FederatedSearchTool(BaseTool):
+    name: str = "federated_search"
+    description: str = (
+        "Search all available web search engines at once and get one merged, deduplicated list of results. "
+        "Use this instead of several separate searches when you want to cross-check information across sources."
+    )
+    providers: Dict[str, Any] = {}
+
+    def _run(self, query: str) -> Dict[str, Any]:
+        return federated_search(query, self.providers)
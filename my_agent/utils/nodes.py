@@ -1,13 +1,23 @@
+import asyncio
 from functools import lru_cache
 from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 # from my_agent.utils.tools import tools
 from my_agent.utils.research_tools import research_tools as tools
 from langgraph.prebuilt import ToolNode
+from my_agent.utils.blob_store import offload_message, hydrate_messages
+from my_agent.utils.cancellation import RunCancelled
 
 
 @lru_cache(maxsize=4)
 def _get_model(model_name: str):
+    """Chat model with the research tools bound."""
+    return _get_base_model(model_name).bind_tools(tools)
+
+
+@lru_cache(maxsize=4)
+def _get_base_model(model_name: str):
+    """Chat model without tools, used where the model should only write text."""
     print(f"Creating model instance for: {model_name}")
     import os
     # Print the first few characters of the key for debugging
@@ -34,7 +44,7 @@ def _get_model(model_name: str):
             anthropic_key = os.environ.get("ANTHROPIC_API_KEY")
             if not anthropic_key or anthropic_key == "...":
                 print("Anthropic API key not found or is placeholder. Falling back to OpenAI.")
-                return _get_model("openai")
+                return _get_base_model("openai")
                 
             model = ChatAnthropic(
                 temperature=0, 
@@ -48,7 +58,6 @@ def _get_model(model_name: str):
         else:
             raise ValueError(f"Unsupported model type: {model_name}")
 
-        model = model.bind_tools(tools)
         return model
     except Exception as e:
         import traceback
@@ -75,7 +84,7 @@ def _get_model(model_name: str):
         # Fall back to OpenAI if there's an error with the requested model
         if model_name != "openai":
             print("Falling back to OpenAI model...")
-            return _get_model("openai")
+            return _get_base_model("openai")
         else:
             # If we're already trying OpenAI and it's failing, raise the error
             raise
@@ -101,16 +110,21 @@ Please use the following tools for specific research needs:
 - serper_search: For credible academic information, research papers, and scientific data. Use this for climate change research, medical information, and academic topics.
 - metaphor_search: For finding recent blog posts, articles, and trending content. Use this for discovering the latest industry trends, technology news, and recent discussions.
 - browse_web: For extracting content from a specific webpage
+- federated_search: Searches all available search engines at once and returns one merged, deduplicated result list. Use this instead of several separate searches when you need to cross-check information.
 
 When a user asks about general knowledge, definitions, or historical facts, ALWAYS use wikipedia_research first.
 When a user asks about research from credible sources, ALWAYS use serper_search.
 When a user asks about recent blog posts or trends, ALWAYS use metaphor_search.
 """
 
+def _build_prompt(state):
+    # Swap blob references back for the full tool output only when building the prompt
+    messages = hydrate_messages(state["messages"])
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + messages
+
 # Define the function that calls the model
 def call_model(state, config):
-    messages = state["messages"]
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + messages
+    messages = _build_prompt(state)
     # Use OpenAI as default instead of anthropic
     model_name = config.get('configurable', {}).get("model_name", "openai")
     model = _get_model(model_name)
@@ -118,8 +132,37 @@ def call_model(state, config):
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
+# Async version used by the API, cancelling the graph task aborts the in-flight request
+async def acall_model(state, config):
+    # Hydrating blobs may read spilled ones from disk, keep that off the event loop
+    messages = await asyncio.to_thread(_build_prompt, state)
+    model_name = config.get('configurable', {}).get("model_name", "openai")
+    # The first call creates and tests the model, don't block the event loop on that
+    model = await asyncio.to_thread(_get_model, model_name)
+    response = await model.ainvoke(messages)
+    return {"messages": [response]}
+
+def _handle_tool_error(e: Exception) -> str:
+    # A cancelled run has to stop, not be reported back to the model as a failed tool call
+    if isinstance(e, RunCancelled):
+        raise e
+    return f"Error: {repr(e)}\n Please fix your mistakes."
+
 # Define the function to execute tools
-tool_node = ToolNode(tools)
+_tool_executor = ToolNode(tools, handle_tool_errors=_handle_tool_error)
+
+def _offload_messages(messages):
+    return [offload_message(m) for m in messages]
+
+def tool_node(state, config):
+    result = _tool_executor.invoke(state, config)
+    # Keep large tool outputs out of the state, only a reference is stored
+    return {"messages": _offload_messages(result["messages"])}
+
+async def atool_node(state, config):
+    result = await _tool_executor.ainvoke(state, config)
+    # Offloading hashes the body and may write to disk, keep that off the event loop
+    return {"messages": await asyncio.to_thread(_offload_messages, result["messages"])}
 
 def select_tool(query: str) -> str:
     """Suggest which tool to use based on the query content."""
@@ -5,14 +5,19 @@ import asyncio
 from typing import Dict, Any, List, Optional, Union, Annotated
 from functools import lru_cache
 
+import requests
 from langchain.tools.base import BaseTool
-from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper, TAVILY_API_URL
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_community.utilities.google_serper import GoogleSerperAPIWrapper
 from langchain_community.tools.google_serper import GoogleSerperRun
 from langchain_community.tools import WikipediaQueryRun
 from langchain_community.utilities import WikipediaAPIWrapper
 
+from my_agent.utils.workers import worker_pool, parse_html
+from my_agent.utils.federated_search import FederatedSearchTool
+from my_agent.utils.cancellation import raise_if_cancelled
+
 
 # Fix SerpAPI imports - using correct modules
 try:
@@ -23,10 +28,11 @@ except ImportError:
 
 # Optional imports for more advanced tools
 try:
-    from langchain_community.document_loaders import WebBaseLoader
-    web_loader_available = True
+    import httpx
+    import bs4
+    web_browsing_available = True
 except ImportError:
-    web_loader_available = False
+    web_browsing_available = False
 
 try:
     from metaphor_python import Metaphor
@@ -35,6 +41,14 @@ except ImportError:
     metaphor_available = False
 
 
+def _request_json(method: str, url: str, timeout: float, **kwargs) -> Dict[str, Any]:
+    # The SDK wrappers send their requests without a timeout, federated_search providers
+    # call the APIs directly so an unresponsive provider can't hold a thread forever
+    response = requests.request(method, url, timeout=timeout, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
 # Fallback tool
 class SimpleSearchTool(BaseTool):
     name: str = "simple_search"
@@ -73,6 +87,8 @@ class WikipediaResearchTool(BaseTool):
 def get_search_tools() -> List[BaseTool]:
     """Create and return available search tools based on API keys."""
     tools = []
+    # Normalized search functions for federated_search: (query, timeout) -> [{"title", "url", "snippet"}]
+    providers = {}
     
 
     # Add Wikipedia tool (free, no API key required)
@@ -97,6 +113,12 @@ def get_search_tools() -> List[BaseTool]:
                 max_results=3,
                 description="Search the web for recent information using Tavily. Use this for finding current facts and news."
             ))
+            providers["tavily"] = lambda query, timeout: [
+                {"title": r.get("title", ""), "url": r.get("url", ""), "snippet": r.get("content", "")}
+                for r in _request_json("POST", f"{TAVILY_API_URL}/search", timeout, json={
+                    "api_key": tavily_api_key, "query": query, "max_results": 5, "search_depth": "advanced",
+                }).get("results", [])
+            ]
         except Exception as e:
             print(f"Error initializing Tavily API: {e}")
     
@@ -109,6 +131,11 @@ def get_search_tools() -> List[BaseTool]:
                 api_wrapper=serper_wrapper,
                 description="Search the web using Google Serper. Good for finding precise information and facts."
             ))
+            providers["serper"] = lambda query, timeout: [
+                {"title": r.get("title", ""), "url": r.get("link", ""), "snippet": r.get("snippet", "")}
+                for r in _request_json("POST", "https://google.serper.dev/search", timeout, params={"q": query},
+                                       headers={"X-API-KEY": serper_api_key}).get("organic", [])
+            ]
             print("Serper tool initialized successfully")
         except Exception as e:
             print(f"Error initializing Serper API: {e}")
@@ -121,6 +148,12 @@ def get_search_tools() -> List[BaseTool]:
             serpapi_tool = SerpAPITool()
             serpapi_tool.api_wrapper = serpapi_wrapper
             tools.append(serpapi_tool)
+            providers["serpapi"] = lambda query, timeout: [
+                {"title": r.get("title", ""), "url": r.get("link", ""), "snippet": r.get("snippet", "")}
+                for r in _request_json("GET", "https://serpapi.com/search", timeout,
+                                       params={**serpapi_wrapper.get_params(query), "output": "json"},
+                                       ).get("organic_results", [])
+            ]
             print("SerpAPI tool initialized successfully")
         except Exception as e:
             print(f"Error initializing SerpAPI: {e}")
@@ -149,13 +182,23 @@ def get_search_tools() -> List[BaseTool]:
                     return {"results": results}
             
             tools.append(MetaphorSearchTool())
+
+            def metaphor_provider(query, timeout):
+                response = _request_json("POST", "https://api.metaphor.systems/search", timeout,
+                                         json={"query": query, "numResults": 5, "useAutoprompt": True},
+                                         headers={"x-api-key": metaphor_api_key})
+                return [
+                    {"title": r.get("title") or "", "url": r.get("url", ""), "snippet": r.get("extract") or ""}
+                    for r in response.get("results", [])
+                ]
+
+            providers["metaphor"] = metaphor_provider
             print("Metaphor search tool initialized successfully")
         except Exception as e:
             print(f"Error initializing Metaphor API: {e}")
     
-    # Add web loading capability if available
-    browserless_api_key = os.environ.get("BROWSERLESS_API_KEY")
-    if browserless_api_key and web_loader_available:
+    # Add web loading capability if available (free, pages are fetched and parsed locally)
+    if web_browsing_available:
         try:
             class WebBrowsingTool(BaseTool):
                 name: str = "browse_web"
@@ -163,14 +206,25 @@ def get_search_tools() -> List[BaseTool]:
                 
                 def _run(self, url: str) -> Dict[str, Any]:
                     try:
-                        loader = WebBaseLoader(
-                            web_paths=[url],
-                            api_key=browserless_api_key
-                        )
-                        docs = loader.load()
-                        return {"content": docs[0].page_content}
+                        response = requests.get(url, timeout=30, headers={"User-Agent": "Mozilla/5.0"})
+                        response.raise_for_status()
                     except Exception as e:
                         return {"error": f"Could not load the webpage: {str(e)}"}
+                    # Don't spend a worker on a page nobody is waiting for any more
+                    raise_if_cancelled()
+                    # Parsing the page is CPU heavy, run it in the worker process pool
+                    return {"content": worker_pool.run_cpu_sync(parse_html, response.text)}
+
+                # Async version used by the API, cancelling the run aborts the download
+                async def _arun(self, url: str) -> Dict[str, Any]:
+                    try:
+                        async with httpx.AsyncClient(timeout=30, follow_redirects=True,
+                                                     headers={"User-Agent": "Mozilla/5.0"}) as client:
+                            response = await client.get(url)
+                            response.raise_for_status()
+                    except Exception as e:
+                        return {"error": f"Could not load the webpage: {str(e)}"}
+                    return {"content": await worker_pool.run_cpu(parse_html, response.text)}
             
             tools.append(WebBrowsingTool())
             print("Web browsing tool initialized successfully")
@@ -178,6 +232,11 @@ def get_search_tools() -> List[BaseTool]:
             print(f"Error initializing Web browsing tool: {e}")
     
     
+    # Federated search only pays off when there is more than one provider to combine
+    if len(providers) > 1:
+        tools.append(FederatedSearchTool(providers=providers))
+        print(f"Federated search tool initialized with providers: {', '.join(providers)}")
+    
     # Add a fallback tool if none of the other tools are available
     if not tools:
         tools.append(SimpleSearchTool())
@@ -1,6 +1,26 @@
 from langgraph.graph import add_messages
 from langchain_core.messages import BaseMessage
-from typing import TypedDict, Annotated, Sequence
+from typing import TypedDict, Annotated, Sequence, List, Dict, Optional
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
+
+def add_findings(existing: Optional[List[Dict[str, str]]], new: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    # None clears the findings, so a checkpointed thread doesn't carry them into the next question
+    if new is None:
+        return []
+    return (existing or []) + new
+
+# State for the deep research mode. Parallel branches append to `findings`,
+# which the reduce step dedupes into `notes` for the final answer.
+class ResearchState(AgentState):
+    sub_queries: List[str]
+    findings: Annotated[List[Dict[str, str]], add_findings]
+    notes: List[Dict[str, str]]
+
+# Reference to a tool output kept in the blob store instead of inline in the state.
+# Stored in ToolMessage.additional_kwargs["blob_ref"].
+class BlobRef(TypedDict):
+    hash: str
+    size: int
+    preview: str
@@ -0,0 +1,220 @@
+"""
+Managed worker pools for work that shouldn't run on the FastAPI event loop.
+
+CPU-heavy tasks (HTML parsing, encoding large JSON) run in a process pool,
+blocking I/O runs in a thread pool. Both are sized from the core count and are
+started and stopped with the app lifespan. Large text arguments are handed to the
+worker processes through shared memory instead of being pickled.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from multiprocessing import shared_memory, resource_tracker
+from typing import Any, Callable, Dict, Optional
+
+CPU_COUNT = os.cpu_count() or 1
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", max(1, CPU_COUNT - 1)))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", min(32, CPU_COUNT + 4)))
+# Text arguments at least this many bytes go through shared memory
+SHARED_MEMORY_THRESHOLD = int(os.environ.get("SHARED_MEMORY_THRESHOLD", 256 * 1024))
+
+
+# ----- Tasks run inside the worker processes -----
+
+def parse_html(html: str) -> str:
+    """Extract the readable text of an HTML page."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _to_jsonable(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    return str(obj)
+
+
+def encode_json(obj: Any) -> str:
+    """Serialize obj (including LangChain messages) to a JSON string."""
+    return json.dumps(obj, ensure_ascii=False, default=_to_jsonable)
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict):
+    # Wall clock time so the parent can work out how long the task sat in the queue
+    started_at = time.time()
+    return started_at, func(*args, **kwargs)
+
+
+def _shared_memory_call(func: Callable, shm_name: str, size: int, args: tuple, kwargs: dict):
+    started_at = time.time()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        text = bytes(shm.buf[:size]).decode("utf-8")
+    finally:
+        shm.close()
+    return started_at, func(text, *args, **kwargs)
+
+
+def _noop():
+    return None
+
+
+# ----- Pool management -----
+
+class WorkerPool:
+    def __init__(self, cpu_workers: int = CPU_WORKERS, io_workers: int = IO_WORKERS):
+        self.cpu_workers = cpu_workers
+        self.io_workers = io_workers
+        self.cpu_executor: Optional[ProcessPoolExecutor] = None
+        self.io_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def started(self) -> bool:
+        return self.cpu_executor is not None
+
+    def start(self):
+        if self.started:
+            return
+        # fork is much cheaper than spawn and doesn't re-import app.py in every worker.
+        # Workers are created right away, before the app starts any other threads.
+        mp_context = multiprocessing.get_context("fork") if sys.platform == "linux" else None
+        # Start the resource tracker first so the workers share it; otherwise every worker
+        # would track the shared memory blocks it attaches to and unlink them again on exit
+        resource_tracker.ensure_running()
+        self.cpu_executor = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=mp_context)
+        self.io_executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="io-worker")
+        for _ in range(self.cpu_workers):
+            self.cpu_executor.submit(_noop)
+        print(f"Worker pool started: {self.cpu_workers} CPU processes, {self.io_workers} I/O threads")
+
+    def shutdown(self):
+        if not self.started:
+            return
+        self.cpu_executor.shutdown(wait=True, cancel_futures=True)
+        self.io_executor.shutdown(wait=True, cancel_futures=True)
+        self.cpu_executor = None
+        self.io_executor = None
+        print("Worker pool stopped")
+
+    def _record(self, name: str, submitted_at: float, started_at: float, finished_at: float, failed: bool):
+        with self._lock:
+            stats = self._stats[name]
+            stats["pending"] -= 1
+            if failed:
+                stats["failed"] += 1
+                return
+            run_seconds = finished_at - started_at
+            stats["completed"] += 1
+            stats["total_queue_seconds"] += max(0.0, started_at - submitted_at)
+            stats["total_run_seconds"] += run_seconds
+            stats["max_run_seconds"] = max(stats["max_run_seconds"], run_seconds)
+
+    def _track(self, name: str):
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                "pending": 0, "completed": 0, "failed": 0,
+                "total_queue_seconds": 0.0, "total_run_seconds": 0.0, "max_run_seconds": 0.0,
+            })
+            stats["pending"] += 1
+
+    def submit_cpu(self, func: Callable, *args, **kwargs) -> Future:
+        """Run func in the process pool. Returns a future with func's result."""
+        name = func.__name__
+        submitted_at = time.time()
+        shm = None
+        text = args[0] if args else None
+        self._track(name)
+        try:
+            if isinstance(text, str) and len(text) >= SHARED_MEMORY_THRESHOLD:
+                data = text.encode("utf-8")
+                shm = shared_memory.SharedMemory(create=True, size=len(data))
+                shm.buf[:len(data)] = data
+                inner = self.cpu_executor.submit(_shared_memory_call, func, shm.name, len(data), args[1:], kwargs)
+            else:
+                inner = self.cpu_executor.submit(_timed_call, func, args, kwargs)
+        except BaseException:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self._record(name, submitted_at, submitted_at, time.time(), failed=True)
+            raise
+
+        result: Future = Future()
+
+        def done(f: Future):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            finished_at = time.time()
+            try:
+                started_at, value = f.result()
+            except BaseException as e:
+                self._record(name, submitted_at, submitted_at, finished_at, failed=True)
+                result.set_exception(e)
+                return
+            self._record(name, submitted_at, started_at, finished_at, failed=False)
+            result.set_result(value)
+
+        inner.add_done_callback(done)
+        return result
+
+    async def run_cpu(self, func: Callable, *args, **kwargs) -> Any:
+        """Await func from the event loop. Runs inline if the pool isn't started."""
+        if not self.started:
+            return func(*args, **kwargs)
+        return await asyncio.wrap_future(self.submit_cpu(func, *args, **kwargs))
+
+    def run_cpu_sync(self, func: Callable, *args, **kwargs) -> Any:
+        """Blocking version of run_cpu for graph nodes and tools running in threads."""
+        if not self.started:
+            return func(*args, **kwargs)
+        return self.submit_cpu(func, *args, **kwargs).result()
+
+    async def run_io(self, func: Callable, *args, **kwargs) -> Any:
+        """Await a blocking I/O call on the thread pool."""
+        if not self.started:
+            return func(*args, **kwargs)
+        name = func.__name__
+        submitted_at = time.time()
+        self._track(name)
+        future = self.io_executor.submit(_timed_call, func, args, kwargs)
+        try:
+            started_at, value = await asyncio.wrap_future(future)
+        except BaseException:
+            self._record(name, submitted_at, submitted_at, time.time(), failed=True)
+            raise
+        self._record(name, submitted_at, started_at, time.time(), failed=False)
+        return value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = {}
+            for name, stats in self._stats.items():
+                completed = stats["completed"]
+                tasks[name] = {
+                    **stats,
+                    "avg_queue_seconds": stats["total_queue_seconds"] / completed if completed else 0.0,
+                    "avg_run_seconds": stats["total_run_seconds"] / completed if completed else 0.0,
+                }
+        return {
+            "started": self.started,
+            "cpu_workers": self.cpu_workers,
+            "io_workers": self.io_workers,
+            "tasks": tasks,
+        }
+
+
+worker_pool = WorkerPool()